@@ -22,10 +22,13 @@
 
 
 import argparse
+from collections import Counter
 from collections import OrderedDict
-import datetime
+import heapq
+import json
 import logging
 from logging.handlers import SysLogHandler
+from multiprocessing.pool import ThreadPool
 import os
 import random
 import retrying
@@ -55,9 +58,26 @@ IDENTITY_API_VERSIONS = {
 }
 
 ROUTER_CACHE_MAX_AGE_SECONDS = 5 * 60
+ROUTER_CACHE_FILE = '/var/cache/neutron-ha-tool/router_counts.json'
+
+# Clock for cache ages; python 2 has no monotonic clock in the stdlib
+monotonic = getattr(time, 'monotonic', time.time)
+
+_argparser = None
 
 
 def make_argparser():
+    """
+    Return the argument parser, building it on first use only. Parsing
+    arguments does not modify the parser, so it can be shared.
+    """
+    global _argparser
+    if _argparser is None:
+        _argparser = build_argparser()
+    return _argparser
+
+
+def build_argparser():
     ap = argparse.ArgumentParser(description=DESCRIPTION)
     ap.add_argument('-d', '--debug', action='store_true',
                     default=False, help='Show debugging output')
@@ -102,12 +122,26 @@ def make_argparser():
                     default='least-busy',
                     help='Determines how target agent is selected for routers '
                          '"random" selects target agent randomly, '
-                         '"least-busy" selects the least busy agent.')
+                         '"least-busy" selects the least busy agent. Agents '
+                         'are ranked by the number of routers they report '
+                         'to host, including HA routers. This differs from --l3-agent-rebalance, '
+                         'which ignores HA routers.')
     ap.add_argument('--router-list-file', default=None,
                     help='Only routers specified in the list file will be '
                          'moved. The router list file should specify one '
                          'router id per line. This only applies for '
                          'agent evacuation.')
+    ap.add_argument('--migration-workers', action='store', type=positive_int,
+                    default=1, metavar='N',
+                    help='Number of routers to migrate concurrently. The '
+                         'target agent of each router is still picked one '
+                         'router at a time.')
+    ap.add_argument('--no-router-count-cache', action='store_false',
+                    default=True, dest='router_count_cache',
+                    help='Do not use the router count per agent cached in '
+                         '%s by a previous run. Only applies to the '
+                         '"least-busy" agent selection mode.'
+                         % ROUTER_CACHE_FILE)
     target_agent_parser = ap.add_mutually_exclusive_group(required=False)
     target_agent_parser.add_argument('--target-agent-id', default=None,
                     help='Explicitly select a target agent by specifying an '
@@ -127,6 +161,14 @@ def make_argparser():
     return ap
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "invalid positive int value: '%s'" % value)
+    return number
+
+
 def parse_args():
     # ensure environment has necessary items to authenticate
     for key in ['OS_USERNAME', 'OS_AUTH_URL', 'OS_REGION_NAME']:
@@ -241,12 +283,13 @@ def run(args):
     keystone = kclient.Client(**kclient_kwargs)
 
     # Instantiate Neutron client
+    endpoint_url = keystone.service_catalog.url_for(
+        service_type='network',
+        endpoint_type=endpoint_type
+    )
     qclient = nclient.Client(
         '2.0',
-        endpoint_url=keystone.service_catalog.url_for(
-            service_type='network',
-            endpoint_type=endpoint_type
-        ),
+        endpoint_url=endpoint_url,
         token=keystone.get_token(keystone.session),
         **kclient_kwargs
     )
@@ -257,7 +300,9 @@ def run(args):
     if args.agent_selection_mode == 'random':
         agent_picker = RandomAgentPicker()
     elif args.agent_selection_mode == 'least-busy':
-        agent_picker = LeastBusyAgentPicker(qclient)
+        cache_file = ROUTER_CACHE_FILE if args.router_count_cache else None
+        agent_picker = LeastBusyAgentPicker(
+            qclient, cache_file=cache_file, cache_key=endpoint_url)
     else:
         raise ValueError('Invalid agent_selection_mode')
 
@@ -279,7 +324,8 @@ def run(args):
         router_filter = NullRouterFilter()
         errors = retry_with_backoff(l3_agent_migrate, args)(
             qclient, agent_picker, router_filter, args.noop, args.now,
-            args.wait_for_router, args.ssh_delete_namespace)
+            args.wait_for_router, args.ssh_delete_namespace,
+            args.migration_workers)
 
     elif args.l3_agent_evacuate:
         LOG.info("Performing L3 Agent Evacuation from host %s",
@@ -291,7 +337,8 @@ def run(args):
             router_filter = NullRouterFilter()
         errors = retry_with_backoff(l3_agent_evacuate, args)(
             qclient, args.l3_agent_evacuate, agent_picker, router_filter,
-            args.noop, args.wait_for_router, args.ssh_delete_namespace)
+            args.noop, args.wait_for_router, args.ssh_delete_namespace,
+            args.migration_workers)
 
     elif args.l3_agent_rebalance:
         LOG.info("Rebalancing L3 Agent Router Count")
@@ -438,7 +485,7 @@ def l3_agent_check(qclient):
 
 def l3_agent_migrate(qclient, agent_picker, router_filter, noop=False,
                      now=False, wait_for_router=True,
-                     ssh_delete_namespace=False):
+                     ssh_delete_namespace=False, workers=1):
     """
     Walk the l3 agents searching for agents that are offline.  For those that
     are offline, we will retrieve a list of routers on them and migrate them to
@@ -450,6 +497,7 @@ def l3_agent_migrate(qclient, agent_picker, router_filter, noop=False,
                 amount of time (between 30 and 60 seconds) before migration,
                 and if an agent comes online, migration is abandoned. If
                 true, routers are migrated immediately.
+    :param workers: Optional number of routers to migrate concurrently
     :returns: total number of errors encountered
     """
 
@@ -492,7 +540,7 @@ def l3_agent_migrate(qclient, agent_picker, router_filter, noop=False,
             migrate_l3_routers_from_agent(qclient, agent, agent_alive_list,
                                           agent_picker, router_filter,
                                           noop, wait_for_router,
-                                          ssh_delete_namespace)
+                                          ssh_delete_namespace, workers)
         total_migrations += migrations
         total_errors += errors
 
@@ -506,7 +554,7 @@ def l3_agent_migrate(qclient, agent_picker, router_filter, noop=False,
 
 def l3_agent_evacuate(qclient, agent_host, agent_picker, router_filter,
                       noop=False, wait_for_router=True,
-                      ssh_delete_namespace=False):
+                      ssh_delete_namespace=False, workers=1):
     """
     Retreive a list of routers scheduled on the listed agent, and move that
     to another agent.
@@ -514,6 +562,7 @@ def l3_agent_evacuate(qclient, agent_host, agent_picker, router_filter,
     :param qclient: A neutronclient
     :param noop: Optional noop flag
     :param agent_host: the hostname of the L3 agent to migrate routers from
+    :param workers: Optional number of routers to migrate concurrently
     :returns: total number of errors encountered
 
     """
@@ -539,7 +588,7 @@ def l3_agent_evacuate(qclient, agent_host, agent_picker, router_filter,
         migrate_l3_routers_from_agent(qclient, agent_to_evacuate,
                                       target_list, agent_picker, router_filter,
                                       noop, wait_for_router,
-                                      ssh_delete_namespace)
+                                      ssh_delete_namespace, workers)
     LOG.info("%d routers %s evacuated from L3 agent %s", migrations,
              "would have been" if noop else "were", agent_host)
     if errors > 0:
@@ -596,21 +645,39 @@ def replicate_dhcp(qclient, noop=False):
 
 def migrate_l3_routers_from_agent(qclient, agent, targets, agent_picker,
                                   router_filter, noop, wait_for_router,
-                                  delete_namespace):
+                                  delete_namespace, workers=1):
     LOG.info("Querying agent_id=%s for routers to migrate away", agent['id'])
     router_id_list = list_routers_on_l3_agent(qclient, agent['id'])
     router_id_list = router_filter.filter_routers(router_id_list)
 
-    migrations = 0
-    errors = 0
+    # Agent pickers are not thread safe, so all targets are picked up
+    # front and only the migrations themselves run concurrently.
     agent_picker.set_agents(targets)
-    for router_id in router_id_list:
-        target = agent_picker.pick()
-        if migrate_router_safely(qclient, noop, router_id, agent,
-                                 target, wait_for_router, delete_namespace):
-            migrations += 1
-        else:
-            errors += 1
+    router_targets = [
+        (router_id, agent_picker.pick()) for router_id in router_id_list
+    ]
+
+    def migrate(router_target):
+        router_id, target = router_target
+        return migrate_router_safely(qclient, noop, router_id, agent,
+                                     target, wait_for_router,
+                                     delete_namespace)
+
+    workers = min(workers, len(router_targets))
+    if workers > 1:
+        LOG.info("Migrating %d routers using %d workers",
+                 len(router_targets), workers)
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(migrate, router_targets)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [migrate(router_target) for router_target in router_targets]
+
+    migrations = sum(1 for migrated in results if migrated)
+    errors = len(results) - migrations
 
     return (migrations, errors)
 
@@ -654,8 +721,9 @@ def migrate_router(qclient, router_id, agent, target,
     qclient.remove_router_from_l3_agent(agent['id'], router_id)
     LOG.debug("Removed router from agent=%s" % agent['id'])
 
-    # ensure it is removed or log an error
-    if router_id in list_routers_on_l3_agent(qclient, agent['id']):
+    # ensure it is removed or log an error. Asking which agents host the
+    # router avoids listing every router on the agents involved.
+    if agent['id'] in list_agents_hosting_router(qclient, router_id):
         raise RuntimeError("Failed to remove router_id=%s from agent_id=%s" %
                            (router_id, agent['id']))
 
@@ -663,8 +731,8 @@ def migrate_router(qclient, router_id, agent, target,
     router_body = {'router_id': router_id}
     qclient.add_router_to_l3_agent(target['id'], router_body)
 
-    # ensure it is removed or log an error
-    if router_id not in list_routers_on_l3_agent(qclient, target['id']):
+    # ensure it is added or log an error
+    if target['id'] not in list_agents_hosting_router(qclient, router_id):
         raise RuntimeError("Failed to add router_id=%s from agent_id=%s" %
                            (router_id, agent['id']))
     if wait_for_router:
@@ -798,6 +866,33 @@ def list_routers_on_l3_agent(qclient, agent_id):
     return [r['id'] for r in resp['routers'] if not r.get('ha') == True]  # noqa
 
 
+def count_routers_on_l3_agent(qclient, agent_id):
+    """
+    Return the number of routers on an agent. Unlike
+    list_routers_on_l3_agent, HA routers are counted, like in the router
+    count agents report in their configurations.
+
+    :param qclient: A neutronclient
+    """
+
+    resp = qclient.list_routers_on_l3_agent(agent_id)
+    LOG.debug("list_routers_on_l3_agent: %s", resp)
+    return len(resp['routers'])
+
+
+def list_agents_hosting_router(qclient, router_id):
+    """
+    Return a list of ids of the l3 agents hosting a router
+
+    :param qclient: A neutronclient
+    :param router_id: The id of the router
+    """
+
+    resp = qclient.list_l3_agent_hosting_routers(router_id)
+    LOG.debug("list_l3_agent_hosting_routers: %s", resp)
+    return [a['id'] for a in resp['agents']]
+
+
 def list_agents(qclient, agent_type=None):
     """Return a list of agent objects
 
@@ -935,39 +1030,186 @@ class RandomAgentPicker(object):
 
 
 class LeastBusyAgentPicker(object):
-    def __init__(self, qclient):
+    # Agents are ranked by the number of routers they report to host in
+    # their configurations, HA routers included. Reports only change on
+    # the agent's heartbeat, so they are read once per run (and again
+    # after ROUTER_CACHE_MAX_AGE_SECONDS) and picks are counted in memory
+    # from then on. l3_agent_rebalance ranks agents by
+    # list_routers_on_l3_agent instead, which leaves out HA routers.
+
+    def __init__(self, qclient, cache_file=None, cache_key=None):
         self.cache_created_at = None
         self.qclient = qclient
+        self.cache_file = cache_file
+        self.cache_key = cache_key
         self.agents_by_id = {}
-        self.router_count_per_agent_id = {}
+        self.router_count_per_agent_id = Counter()
+        # (router count, agent id) pairs, the least busy agent first
+        self.router_count_heap = []
 
     def set_agents(self, agents):
         self.agents_by_id = {agent['id']: agent for agent in agents}
-        self.refresh_router_count_per_agent_id()
+        # Counts in memory include the routers placed so far in this run,
+        # so prefer them over both the cache file and Neutron.
+        if self.keep_router_count_per_agent_id():
+            return
+        if not self.load_router_count_per_agent_id():
+            self.refresh_router_count_per_agent_id()
+
+    def keep_router_count_per_agent_id(self):
+        """
+        Keep the in-memory router counts if they are fresh and cover all
+        agents. Returns True if they were kept, False otherwise.
+        """
+        if self.cache_created_at is None or self.cache_expired():
+            return False
+        if not all(agent_id in self.router_count_per_agent_id
+                   for agent_id in self.agents_by_id):
+            return False
+
+        self.router_count_per_agent_id = Counter({
+            agent_id: self.router_count_per_agent_id[agent_id]
+            for agent_id in self.agents_by_id
+        })
+        self.rebuild_router_count_heap()
+        return True
+
+    def read_cache_file(self):
+        try:
+            with open(self.cache_file, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, ValueError) as e:
+            LOG.debug("Could not read router count cache %s: %s",
+                      self.cache_file, e)
+            return {}
+        if not isinstance(cache, dict):
+            LOG.debug("Ignoring malformed router count cache %s",
+                      self.cache_file)
+            return {}
+        return cache
+
+    def load_router_count_per_agent_id(self):
+        """
+        Load the router count per agent from the cache file written by a
+        previous run. Returns True if the cache was fresh and covered all
+        agents, False otherwise.
+        """
+        if not self.cache_file:
+            return False
+
+        cache = self.read_cache_file().get(self.cache_key)
+        if not cache:
+            return False
+
+        try:
+            cache_life = time.time() - cache['created_at']
+            counts = cache['counts']
+            router_count_per_agent_id = Counter({
+                agent_id: int(counts[agent_id])
+                for agent_id in self.agents_by_id
+            })
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            LOG.debug("Ignoring malformed router count cache %s: %s",
+                      self.cache_file, e)
+            return False
+
+        if not 0 <= cache_life <= ROUTER_CACHE_MAX_AGE_SECONDS:
+            return False
+
+        LOG.info("Using router count per agent cache from %s",
+                 self.cache_file)
+        self.router_count_per_agent_id = router_count_per_agent_id
+        self.rebuild_router_count_heap()
+        self.cache_created_at = monotonic() - cache_life
+        return True
+
+    def save_router_count_per_agent_id(self):
+        """
+        Write the router counts just fetched from Neutron to the cache
+        file. Counts from picks are never saved: picked agents may not
+        end up hosting the router (noop runs, failed migrations).
+        """
+        if not self.cache_file:
+            return
+
+        cache = self.read_cache_file()
+        cache_life = monotonic() - self.cache_created_at
+        cache[self.cache_key] = {
+            'created_at': time.time() - cache_life,
+            'counts': self.router_count_per_agent_id
+        }
+        tmp_file = self.cache_file + '.tmp'
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(tmp_file, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError) as e:
+            LOG.debug("Could not write router count cache %s: %s",
+                      self.cache_file, e)
+
+    def discard_cache_file(self):
+        """
+        Remove the cache file and stop using it. Once routers are being
+        placed, the saved counts no longer match what agents host.
+        """
+        if not self.cache_file:
+            return
+
+        try:
+            os.remove(self.cache_file)
+        except OSError as e:
+            LOG.debug("Could not remove router count cache %s: %s",
+                      self.cache_file, e)
+        self.cache_file = None
 
     def refresh_router_count_per_agent_id(self):
         LOG.info("Refreshing router count per agent cache")
-        self.router_count_per_agent_id = {}
+        # L3 agents report the number of routers they host in their
+        # configurations, so a single list_agents call is enough for
+        # most agents. Only fall back to querying the agent's routers
+        # if it does not report the count.
+        # N.B. The reported count includes HA routers and is only updated
+        # on the agent's heartbeat. HA routers load the agent as well, so
+        # the fallback counts them too, to rank all agents the same way.
+        reported_router_count_per_agent_id = {
+            agent['id']: agent.get('configurations', {}).get('routers')
+            for agent in list_agents(self.qclient, agent_type='L3 agent')
+        }
+        self.router_count_per_agent_id = Counter()
         for agent_id in self.agents_by_id:
-            self.router_count_per_agent_id[agent_id] = len(
-                list_routers_on_l3_agent(self.qclient, agent_id)
-            )
-        self.cache_created_at = datetime.datetime.now()
+            router_count = reported_router_count_per_agent_id.get(agent_id)
+            if router_count is None:
+                router_count = count_routers_on_l3_agent(self.qclient,
+                                                         agent_id)
+            self.router_count_per_agent_id[agent_id] = router_count
+        self.rebuild_router_count_heap()
+        self.cache_created_at = monotonic()
+        self.save_router_count_per_agent_id()
+
+    def rebuild_router_count_heap(self):
+        self.router_count_heap = [
+            (router_count, agent_id) for agent_id, router_count
+            in self.router_count_per_agent_id.items()
+        ]
+        heapq.heapify(self.router_count_heap)
 
     def cache_expired(self):
-        cache_life = datetime.datetime.now() - self.cache_created_at
-        return cache_life.total_seconds() > ROUTER_CACHE_MAX_AGE_SECONDS
+        cache_life = monotonic() - self.cache_created_at
+        return cache_life > ROUTER_CACHE_MAX_AGE_SECONDS
 
     def pick(self):
         if self.cache_expired():
             self.refresh_router_count_per_agent_id()
 
-        agent_id_number_of_routers = sorted(
-            self.router_count_per_agent_id.items(),
-            key=lambda x: (x[1], x[0])
-        )
-        agent_id = agent_id_number_of_routers[0][0]
+        # Ties are broken by agent id. Raises IndexError without agents,
+        # as random.choice does.
+        router_count, agent_id = self.router_count_heap[0]
+        heapq.heapreplace(self.router_count_heap, (router_count + 1, agent_id))
         self.router_count_per_agent_id[agent_id] += 1
+        self.discard_cache_file()
         return self.agents_by_id[agent_id]
 
 
@@ -978,63 +1220,89 @@ class NullRouterFilter(object):
 
 class WhitelistRouterFilter(object):
     def __init__(self, router_id_whitelist):
-        self.router_id_whitelist = set(router_id_whitelist)
+        self.router_id_whitelist = frozenset(router_id_whitelist)
 
     def filter_routers(self, router_id_list):
-        return list(self.router_id_whitelist & set(router_id_list))
+        return [router_id for router_id in router_id_list
+                if router_id in self.router_id_whitelist]
 
 
 def load_router_ids(path):
-    router_ids = []
+    # str.split() without arguments strips the ids and skips empty lines
     with open(path, 'r') as router_list_file:
-        for line in router_list_file.read().split():
-            router_ids.append(line.strip())
-    return router_ids
+        return router_list_file.read().split()
 
 
 class AgentIdBasedAgentPicker(object):
     def __init__(self, agent_id):
-        self.agents = []
+        self.agents_by_id = {}
         self.agent_id = agent_id
 
     def set_agents(self, agents):
-        self.agents = agents
+        # reversed, so that the first agent with a given id wins
+        self.agents_by_id = {
+            agent.get('id'): agent for agent in reversed(agents)
+        }
 
     def pick(self):
-        for agent in self.agents:
-            if agent.get('id') == self.agent_id:
-                return agent
-        raise IndexError(
-            'Cannot find agent with agent id: {}'.format(self.agent_id)
-        )
+        try:
+            return self.agents_by_id[self.agent_id]
+        except KeyError:
+            raise IndexError(
+                'Cannot find agent with agent id: {}'.format(self.agent_id)
+            )
 
 
 class HostBasedAgentPicker(object):
     def __init__(self, host):
-        self.agents = []
+        self.agents_by_host = {}
         self.host = host
 
     def set_agents(self, agents):
-        self.agents = agents
+        # reversed, so that the first agent on a given host wins
+        self.agents_by_host = {
+            agent.get('host'): agent for agent in reversed(agents)
+        }
 
     def pick(self):
-        for agent in self.agents:
-            if agent.get('host') == self.host:
-                return agent
-        raise IndexError(
-            'Cannot find agent with host: {}'.format(self.host)
-        )
+        try:
+            return self.agents_by_host[self.host]
+        except KeyError:
+            raise IndexError(
+                'Cannot find agent with host: {}'.format(self.host)
+            )
 
 
 class RemoteRouterNsCleanup(object):
 
+    # Directory in which "ip netns" keeps a file per named namespace
+    NETNS_RUN_DIR = '/var/run/netns'
+
+    # Runs on the remote host in a single ssh session: terminate all
+    # processes in the namespace (using SIGKILL on the last try) and
+    # delete it. Nothing is done if the namespace does not exist.
+    # The namespace may vanish meanwhile, so its existence is checked
+    # again before deleting it. Only sleep if processes are left.
+    NETNS_CLEANUP_SCRIPT = (
+        'ns={namespace}; '
+        '[ -e {netns_run_dir}/"$ns" ] || exit 0; '
+        'for sig in TERM TERM KILL; do '
+        'pids=$(ip netns pids "$ns" 2>/dev/null) || break; '
+        '[ -n "$pids" ] || break; '
+        'kill -s $sig $pids 2>/dev/null; '
+        '[ $sig = KILL ] || '
+        '[ -z "$(ip netns pids "$ns" 2>/dev/null)" ] || sleep 1; '
+        'done; '
+        '[ -e {netns_run_dir}/"$ns" ] || exit 0; '
+        'ip netns delete "$ns"'
+    )
+
     def __init__(self, host, routerid):
         self.target_host = host
         self.namespace = "qrouter-" + routerid
         self.timeout = 10
-        self.netns_del = "ip netns delete " + self.namespace
-        self.netns_pids = "ip netns pids " + self.namespace
-        self.netns_list = "ip netns list"
+        self.netns_cleanup = self.NETNS_CLEANUP_SCRIPT.format(
+            namespace=self.namespace, netns_run_dir=self.NETNS_RUN_DIR)
 
     def _simple_ssh_command(self, command):
         # Note, that when get_pty is True, paramiko will never return anything
@@ -1047,56 +1315,6 @@ class RemoteRouterNsCleanup(object):
         rc = stdout.channel.recv_exit_status()
         return [rc, [line.strip() for line in out_lines]]
 
-    def _namespace_exists(self):
-        rc, out_lines = self._simple_ssh_command(self.netns_list)
-        return self.namespace in out_lines
-
-    def _get_namespace_pids(self):
-        rc, out_lines = self._simple_ssh_command(self.netns_pids)
-        if rc:
-            if out_lines and "No such file or directory" in out_lines[0]:
-                # Assume the namespace was delete meanwhile
-                return []
-            else:
-                raise RuntimeError("Failed to get pids for namespace %s",
-                                   self.namespace)
-        else:
-            return out_lines
-
-    def _kill_pids_in_namespace(self):
-        LOG.debug("Trying to terminate all processes namespace "
-                  "%s on host %s", self.namespace, self.target_host)
-        remaining = 3
-        pids = self._get_namespace_pids()
-        while pids:
-            LOG.debug("Processes still running: [%s]", ", ".join(pids))
-            for pid in pids:
-                killcmd = "kill "
-                # use more force (kill -9) on the last try
-                if remaining == 1:
-                    LOG.debug("Last try. Using SIGKILL now")
-                    killcmd = "kill -9 "
-
-                rc, out_lines = self._simple_ssh_command(killcmd + pid)
-                if rc:
-                    if out_lines and "No such process" in out_lines[0]:
-                        # Assume the process was stopped meanwhile
-                        return None
-                    else:
-                        raise RuntimeError("Failed to kill %s on host %s",
-                                           pid, self.target_host)
-
-            remaining -= 1
-            if remaining:
-                pids = self._get_namespace_pids()
-                if pids:
-                    LOG.debug("Some processes are still running in namespace "
-                              "%s on host %s. Retrying.", self.namespace,
-                              self.target_host)
-                    time.sleep(1)
-            else:
-                break
-
     def delete_router_namespace(self):
         LOG.debug("Deleting namespace %s on host %s.",
                   self.namespace,
@@ -1108,12 +1326,16 @@ class RemoteRouterNsCleanup(object):
         self.ssh_client.connect(self.target_host, timeout=self.timeout)
         with self.ssh_client:
             try:
-                if self._namespace_exists():
-                    self._kill_pids_in_namespace()
-                    self._simple_ssh_command(self.netns_del)
+                rc, out_lines = self._simple_ssh_command(self.netns_cleanup)
             except socket.timeout:
                 LOG.warn("SSH timeout exceeded. Failed to delete namespace "
                          "%s on %s", self.namespace, self.target_host)
+                return
+
+        if rc:
+            raise RuntimeError("Failed to delete namespace %s on host %s: %s"
+                               % (self.namespace, self.target_host,
+                                  " ".join(out_lines)))
 
 
 if __name__ == '__main__':
@@ -1,12 +1,17 @@
 import argparse
-import datetime
 import unittest
 import collections
 import importlib
+import json
 import logging
+import os
+import shutil
+import subprocess
 import tempfile
+import threading
 import mock
 import socket
+import time
 
 ha_tool = importlib.import_module("neutron-ha-tool")
 
@@ -16,53 +21,90 @@ class FakeNeutron(object):
         self.routers = {}
         self.agents = {}
         self.routers_by_agent = collections.defaultdict(set)
+        self.router_to_agent = {}
+
+    # add_agent and add_router take ownership of the props dict passed in
 
     def add_agent(self, agent_id, props):
-        self.agents[agent_id] = dict(props, id=agent_id)
+        props['id'] = agent_id
+        self.agents[agent_id] = props
 
     def add_router(self, agent_id, router_id, props):
-        self.routers[router_id] = dict(props, id=router_id)
+        props['id'] = router_id
+        self.routers[router_id] = props
+        self.add_router_to_agent(agent_id, router_id)
+
+    def add_router_to_agent(self, agent_id, router_id):
         self.routers_by_agent[agent_id].add(router_id)
+        self.router_to_agent[router_id] = agent_id
 
-    def agent_by_router(self, router_id):
-        for agent_id, router_ids in self.routers_by_agent.items():
-            if router_id in router_ids:
-                return self.agents[agent_id]
+    def remove_router_from_agent(self, agent_id, router_id):
+        self.routers_by_agent[agent_id].remove(router_id)
+        if self.router_to_agent.get(router_id) == agent_id:
+            del self.router_to_agent[router_id]
 
-        raise NotImplementedError()
+    def agent_by_router(self, router_id):
+        try:
+            return self.agents[self.router_to_agent[router_id]]
+        except KeyError:
+            raise NotImplementedError()
 
 
 class FakeNeutronClient(object):
     def __init__(self, fake_neutron):
         self.fake_neutron = fake_neutron
+        # routers may be migrated concurrently
+        self.lock = threading.Lock()
 
     def list_agents(self):
+        # L3 agents report the number of routers they host
+        agents = []
+        with self.lock:
+            for agent in self.fake_neutron.agents.values():
+                configurations = dict(
+                    agent.get('configurations', {}),
+                    routers=len(
+                        self.fake_neutron.routers_by_agent[agent['id']])
+                )
+                agents.append(dict(agent, configurations=configurations))
         return {
-            'agents': self.fake_neutron.agents.values()
+            'agents': agents
         }
 
     def list_routers_on_l3_agent(self, agent_id):
+        with self.lock:
+            router_ids = list(self.fake_neutron.routers_by_agent[agent_id])
         return {
             'routers': [
                 self.fake_neutron.routers[router_id]
-                for router_id in self.fake_neutron.routers_by_agent[agent_id]
+                for router_id in router_ids
             ]
         }
 
+    def list_l3_agent_hosting_routers(self, router_id):
+        with self.lock:
+            agent_id = self.fake_neutron.router_to_agent.get(router_id)
+        return {
+            'agents': [self.fake_neutron.agents[agent_id]] if agent_id else []
+        }
+
     def remove_router_from_l3_agent(self, agent_id, router_id):
-        self.fake_neutron.routers_by_agent[agent_id].remove(router_id)
+        with self.lock:
+            self.fake_neutron.remove_router_from_agent(agent_id, router_id)
 
     def add_router_to_l3_agent(self, agent_id, router_body):
-        self.fake_neutron.routers_by_agent[agent_id].add(
-            router_body['router_id'])
+        with self.lock:
+            self.fake_neutron.add_router_to_agent(
+                agent_id, router_body['router_id'])
 
     def list_ports(self, device_id, fields):
+        with self.lock:
+            agent = self.fake_neutron.agent_by_router(device_id)
         return {
             'ports': [
                 {
                     'id': 'someid',
-                    'binding:host_id':
-                        self.fake_neutron.agent_by_router(device_id)['host'],
+                    'binding:host_id': agent['host'],
                     'binding:vif_type': 'non distributed',
                     'status': 'ACTIVE'
                 }
@@ -80,6 +122,35 @@ class FakeNeutronClient(object):
         }
 
 
+def record_concurrent_calls(neutron_client, method_name, timeout=1):
+    """
+    Make a FakeNeutronClient method wait until another call of it runs at
+    the same time, or timeout seconds pass, and record the largest number
+    of calls that were running at once.
+    """
+    method = getattr(neutron_client, method_name)
+    calls = {'running': 0, 'max_running': 0}
+    lock = threading.Lock()
+    overlapped = threading.Event()
+
+    def wait_for_concurrent_call(*args, **kwargs):
+        with lock:
+            calls['running'] += 1
+            calls['max_running'] = max(calls['max_running'],
+                                       calls['running'])
+            if calls['running'] > 1:
+                overlapped.set()
+        overlapped.wait(timeout)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            with lock:
+                calls['running'] -= 1
+
+    setattr(neutron_client, method_name, wait_for_concurrent_call)
+    return calls
+
+
 def setup_fake_neutron(live_agents=0, dead_agents=0):
     fake_neutron = FakeNeutron()
 
@@ -145,6 +216,107 @@ class TestL3AgentMigrate(unittest.TestCase):
         self.assertEqual(
             set(['router-1']), fake_neutron.routers_by_agent['live-agent-0'])
 
+    def test_migrate_with_multiple_workers_moves_all_routers(self):
+        fake_neutron = setup_fake_neutron(live_agents=2, dead_agents=1)
+        neutron_client = FakeNeutronClient(fake_neutron)
+        for i in range(5):
+            fake_neutron.add_router('dead-agent-0', 'router-{}'.format(i), {})
+        calls = record_concurrent_calls(neutron_client,
+                                        'remove_router_from_l3_agent')
+
+        with mock.patch.object(ha_tool, 'ThreadPool',
+                               wraps=ha_tool.ThreadPool) as thread_pool:
+            error_count = ha_tool.l3_agent_migrate(
+                neutron_client, ha_tool.LeastBusyAgentPicker(neutron_client),
+                ha_tool.NullRouterFilter(), now=True, workers=3
+            )
+
+        self.assertEqual(0, error_count)
+        thread_pool.assert_called_once_with(3)
+        self.assertGreater(calls['max_running'], 1)
+        self.assertEqual(set(), fake_neutron.routers_by_agent['dead-agent-0'])
+        self.assertEqual(
+            set(['router-{}'.format(i) for i in range(5)]),
+            fake_neutron.routers_by_agent['live-agent-0'] |
+            fake_neutron.routers_by_agent['live-agent-1']
+        )
+        self.assertEqual(
+            [2, 3],
+            sorted(len(fake_neutron.routers_by_agent[agent_id])
+                   for agent_id in ['live-agent-0', 'live-agent-1'])
+        )
+
+
+class TestMigrateRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.fake_neutron = setup_fake_neutron(live_agents=1, dead_agents=1)
+        self.neutron_client = FakeNeutronClient(self.fake_neutron)
+        self.fake_neutron.add_router('dead-agent-0', 'router', {})
+        self.agent = self.fake_neutron.agents['dead-agent-0']
+        self.target = self.fake_neutron.agents['live-agent-0']
+
+    def test_router_moved_without_listing_routers_on_agents(self):
+        with mock.patch.object(self.neutron_client,
+                               'list_routers_on_l3_agent') as list_routers:
+            ha_tool.migrate_router(self.neutron_client, 'router',
+                                   self.agent, self.target)
+
+        self.assertFalse(list_routers.called)
+        self.assertEqual(
+            set(['router']),
+            self.fake_neutron.routers_by_agent['live-agent-0']
+        )
+
+    def test_failed_removal_raises_runtime_error(self):
+        with mock.patch.object(self.neutron_client,
+                               'remove_router_from_l3_agent'):
+            with self.assertRaises(RuntimeError) as ctx:
+                ha_tool.migrate_router(self.neutron_client, 'router',
+                                       self.agent, self.target)
+
+        self.assertEqual(
+            'Failed to remove router_id=router from agent_id=dead-agent-0',
+            str(ctx.exception))
+
+    def test_failed_addition_raises_runtime_error(self):
+        with mock.patch.object(self.neutron_client,
+                               'add_router_to_l3_agent'):
+            with self.assertRaises(RuntimeError):
+                ha_tool.migrate_router(self.neutron_client, 'router',
+                                       self.agent, self.target)
+
+
+class TestL3AgentMigrateWithRouterCountCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache_file = os.path.join(self.cache_dir, 'router_counts.json')
+
+    def test_migrate_from_two_dead_agents_balances_all_routers(self):
+        fake_neutron = setup_fake_neutron(live_agents=2, dead_agents=2)
+        neutron_client = FakeNeutronClient(fake_neutron)
+        for i in range(4):
+            fake_neutron.add_router('dead-agent-0', 'router-0-{}'.format(i),
+                                    {})
+            fake_neutron.add_router('dead-agent-1', 'router-1-{}'.format(i),
+                                    {})
+            fake_neutron.add_router('live-agent-1', 'router-2-{}'.format(i),
+                                    {})
+        agent_picker = ha_tool.LeastBusyAgentPicker(
+            neutron_client, cache_file=self.cache_file, cache_key='endpoint')
+
+        error_count = ha_tool.l3_agent_migrate(
+            neutron_client, agent_picker, ha_tool.NullRouterFilter(),
+            now=True
+        )
+
+        self.assertEqual(0, error_count)
+        self.assertEqual(6, len(fake_neutron.routers_by_agent['live-agent-0']))
+        self.assertEqual(6, len(fake_neutron.routers_by_agent['live-agent-1']))
+        self.assertFalse(os.path.exists(self.cache_file))
+
 
 class TestL3AgentEvacuate(unittest.TestCase):
 
@@ -176,14 +348,45 @@ class TestL3AgentEvacuate(unittest.TestCase):
         )
 
 
+    def test_evacuate_with_multiple_workers_moves_routers_concurrently(self):
+        fake_neutron = setup_fake_neutron(live_agents=3)
+        neutron_client = FakeNeutronClient(fake_neutron)
+        for i in range(4):
+            fake_neutron.add_router('live-agent-0', 'router-{}'.format(i), {})
+        calls = record_concurrent_calls(neutron_client,
+                                        'remove_router_from_l3_agent')
+
+        with mock.patch.object(ha_tool, 'ThreadPool',
+                               wraps=ha_tool.ThreadPool) as thread_pool:
+            error_count = ha_tool.l3_agent_evacuate(
+                neutron_client, 'live-agent-0-host',
+                ha_tool.LeastBusyAgentPicker(neutron_client),
+                ha_tool.NullRouterFilter(), workers=2
+            )
+
+        self.assertEqual(0, error_count)
+        thread_pool.assert_called_once_with(2)
+        self.assertGreater(calls['max_running'], 1)
+        self.assertEqual(set(), fake_neutron.routers_by_agent['live-agent-0'])
+        self.assertEqual(
+            [2, 2],
+            [len(fake_neutron.routers_by_agent[agent_id])
+             for agent_id in ['live-agent-1', 'live-agent-2']]
+        )
+
+
 class TestLeastBusyAgentPicker(unittest.TestCase):
 
     def setUp(self):
         self.fake_neutron = setup_fake_neutron(live_agents=2)
         self.neutron_client = FakeNeutronClient(self.fake_neutron)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache_file = os.path.join(self.cache_dir, 'router_counts.json')
 
-    def make_picker_and_set_agents(self):
-        picker = ha_tool.LeastBusyAgentPicker(self.neutron_client)
+    def make_picker_and_set_agents(self, cache_file=None):
+        picker = ha_tool.LeastBusyAgentPicker(
+            self.neutron_client, cache_file=cache_file, cache_key='endpoint')
         picker.set_agents(
             [
                 {'id': 'live-agent-0'},
@@ -204,6 +407,58 @@ class TestLeastBusyAgentPicker(unittest.TestCase):
             picker.router_count_per_agent_id
         )
 
+    def test_router_count_taken_from_agent_configurations(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+
+        with mock.patch.object(self.neutron_client,
+                               'list_routers_on_l3_agent') as list_routers:
+            picker = self.make_picker_and_set_agents()
+
+        self.assertFalse(list_routers.called)
+        self.assertEqual(
+            {
+                'live-agent-0': 1,
+                'live-agent-1': 0
+            },
+            picker.router_count_per_agent_id
+        )
+
+    def test_agent_not_reporting_router_count_is_queried(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+        agents = self.neutron_client.list_agents()['agents']
+        del agents[0]['configurations']['routers']
+        del agents[1]['configurations']['routers']
+
+        with mock.patch.object(self.neutron_client, 'list_agents',
+                               return_value={'agents': agents}):
+            picker = self.make_picker_and_set_agents()
+
+        self.assertEqual(
+            {
+                'live-agent-0': 1,
+                'live-agent-1': 0
+            },
+            picker.router_count_per_agent_id
+        )
+
+    def test_ha_routers_counted_when_agent_not_reporting_count(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+        self.fake_neutron.add_router('live-agent-1', 'ha-router',
+                                     {'ha': True})
+        agents = self.neutron_client.list_agents()['agents']
+        reported_counts = {
+            agent['id']: agent['configurations']['routers']
+            for agent in agents
+        }
+        del agents[0]['configurations']['routers']
+
+        with mock.patch.object(self.neutron_client, 'list_agents',
+                               return_value={'agents': agents}):
+            picker = self.make_picker_and_set_agents()
+
+        # the fallback counts routers the same way agents report them
+        self.assertEqual(reported_counts, picker.router_count_per_agent_id)
+
     def test_agent_with_smallest_number_of_routers_picked(self):
         self.fake_neutron.add_router('live-agent-0', 'router', {})
         picker = self.make_picker_and_set_agents()
@@ -227,21 +482,120 @@ class TestLeastBusyAgentPicker(unittest.TestCase):
 
     def test_router_per_agent_cache_updated_when_cache_expired(self):
         # initializing the picker will also query neutron
-        picker = self.make_picker_and_set_agents()
+        picker = self.make_picker_and_set_agents(cache_file=self.cache_file)
 
         # Add some routers to live-agent-0 to make sure it's the busyest
         self.fake_neutron.add_router('live-agent-0', 'router-2', {})
         self.fake_neutron.add_router('live-agent-0', 'router-3', {})
 
         # Emulate that cache has expired
-        picker.cache_created_at = (
-            picker.cache_created_at - datetime.timedelta(
-                seconds=ha_tool.ROUTER_CACHE_MAX_AGE_SECONDS + 1)
-        )
+        picker.cache_created_at -= ha_tool.ROUTER_CACHE_MAX_AGE_SECONDS + 1
 
         # pick returns live-agent-1 - that means it consulted neutron
         self.assertEqual('live-agent-1', picker.pick()['id'])
 
+    def test_cache_file_holds_counts_fetched_from_neutron(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+        self.make_picker_and_set_agents(cache_file=self.cache_file)
+
+        with open(self.cache_file) as cache_file:
+            cache = json.load(cache_file)
+        self.assertEqual(
+            {
+                'live-agent-0': 1,
+                'live-agent-1': 0
+            },
+            cache['endpoint']['counts']
+        )
+
+    def test_picking_an_agent_discards_cache_file(self):
+        picker = self.make_picker_and_set_agents(cache_file=self.cache_file)
+
+        picker.pick()
+
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_router_per_agent_cache_file_reused_by_next_picker(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+        self.make_picker_and_set_agents(cache_file=self.cache_file)
+
+        with mock.patch.object(self.neutron_client,
+                               'list_agents') as list_agents:
+            picker = self.make_picker_and_set_agents(
+                cache_file=self.cache_file)
+
+        self.assertFalse(list_agents.called)
+        self.assertEqual(
+            {
+                'live-agent-0': 1,
+                'live-agent-1': 0
+            },
+            picker.router_count_per_agent_id
+        )
+
+    def test_set_agents_keeps_counts_of_routers_picked_in_this_run(self):
+        picker = self.make_picker_and_set_agents(cache_file=self.cache_file)
+        picker.pick()
+
+        with mock.patch.object(self.neutron_client,
+                               'list_agents') as list_agents:
+            picker.set_agents([{'id': 'live-agent-0'}])
+
+        self.assertFalse(list_agents.called)
+        self.assertEqual({'live-agent-0': 1},
+                         picker.router_count_per_agent_id)
+        self.assertEqual('live-agent-0', picker.pick()['id'])
+
+    def test_malformed_router_per_agent_cache_file_ignored(self):
+        self.fake_neutron.add_router('live-agent-0', 'router', {})
+        malformed_caches = [
+            [],
+            {'endpoint': []},
+            {'endpoint': {'counts': {}}},
+            {'endpoint': {'created_at': time.time()}},
+            {'endpoint': {'created_at': 'now', 'counts': {}}},
+            {'endpoint': {'created_at': time.time(), 'counts': []}},
+        ]
+
+        for malformed_cache in malformed_caches:
+            with open(self.cache_file, 'w') as cache_file:
+                json.dump(malformed_cache, cache_file)
+
+            picker = self.make_picker_and_set_agents(
+                cache_file=self.cache_file)
+
+            self.assertEqual(
+                {
+                    'live-agent-0': 1,
+                    'live-agent-1': 0
+                },
+                picker.router_count_per_agent_id
+            )
+
+    def test_expired_router_per_agent_cache_file_ignored(self):
+        with open(self.cache_file, 'w') as cache_file:
+            json.dump({
+                'endpoint': {
+                    'created_at': (
+                        time.time() - ha_tool.ROUTER_CACHE_MAX_AGE_SECONDS - 1
+                    ),
+                    'counts': {
+                        'live-agent-0': 5,
+                        'live-agent-1': 5
+                    }
+                }
+            }, cache_file)
+
+        picker = self.make_picker_and_set_agents(cache_file=self.cache_file)
+
+        self.assertEqual(
+            {
+                'live-agent-0': 0,
+                'live-agent-1': 0
+            },
+            picker.router_count_per_agent_id
+        )
+
     def test_cache_reloaded_if_difference_is_a_day(self):
         # initializing the picker will also query neutron
         picker = self.make_picker_and_set_agents()
@@ -251,13 +605,30 @@ class TestLeastBusyAgentPicker(unittest.TestCase):
         self.fake_neutron.add_router('live-agent-0', 'router-3', {})
 
         # Emulate that cache has expired
-        picker.cache_created_at = (
-            picker.cache_created_at - datetime.timedelta(days=1)
-        )
+        picker.cache_created_at -= 24 * 60 * 60
 
         # pick returns live-agent-1 - that means it consulted neutron
         self.assertEqual('live-agent-1', picker.pick()['id'])
 
+    def test_picks_spread_over_agents_by_router_count(self):
+        self.fake_neutron.add_router('live-agent-0', 'router-1', {})
+        self.fake_neutron.add_router('live-agent-0', 'router-2', {})
+        picker = self.make_picker_and_set_agents()
+
+        picked_agent_ids = [picker.pick()['id'] for _ in range(4)]
+
+        self.assertEqual(
+            ['live-agent-1', 'live-agent-1', 'live-agent-0', 'live-agent-1'],
+            picked_agent_ids
+        )
+        self.assertEqual(
+            {
+                'live-agent-0': 3,
+                'live-agent-1': 3
+            },
+            picker.router_count_per_agent_id
+        )
+
     def test_pick_on_empty_array_throws_index_error_as_random_does(self):
         picker = ha_tool.LeastBusyAgentPicker(self.neutron_client)
         picker.set_agents([])
@@ -312,71 +683,148 @@ class TestWhitelistRouterFilter(unittest.TestCase):
 
         self.assertEqual(['router-id-1'], filtered_router_ids)
 
+    def test_order_of_router_ids_preserved(self):
+        router_filter = ha_tool.WhitelistRouterFilter(
+            ['router-id-1', 'router-id-2', 'router-id-3'])
 
-class TestSshDeleteRouterNamespace(unittest.TestCase):
+        filtered_router_ids = router_filter.filter_routers(
+            ['router-id-3', 'router-id-4', 'router-id-1']
+        )
 
-    @mock.patch('neutron-ha-tool.paramiko.SSHClient')
-    def test_namespace_deleted(self, mock_ssh):
-        self.ssh_exec_side_effect_counter = 0
+        self.assertEqual(['router-id-3', 'router-id-1'], filtered_router_ids)
+
+
+class TestSshDeleteRouterNamespace(unittest.TestCase):
 
+    def make_ssh_exec_side_effect(self, rc, out_lines):
         def ssh_exec_side_effect(*args, **kwargs):
             mock_stdout = mock.MagicMock()
-            mock_stdout.readlines.return_value = []
-            mock_stdout.channel.recv_exit_status.return_value = 0
-            if args[0].startswith('ip netns pids'):
-                if not self.ssh_exec_side_effect_counter:
-                    mock_stdout.readlines.return_value = [
-                        "1234\r\n", "1235\r\n"
-                    ]
-                    self.ssh_exec_side_effect_counter += 1
-
-            if args[0].startswith('ip netns list'):
-                if not self.ssh_exec_side_effect_counter:
-                    mock_stdout.readlines.return_value = [
-                        "qrouter-routerid1\r\n",
-                        "qrouter-otherid\r\n"
-                    ]
-                else:
-                    mock_stdout.readlines.return_value = [
-                        "qrouter-otherid\r\n"
-                    ]
-
-            return [mock.MagicMock, mock_stdout, mock.MagicMock]
-
-        mock_ssh.return_value.exec_command.side_effect = ssh_exec_side_effect
+            mock_stdout.readlines.return_value = out_lines
+            mock_stdout.channel.recv_exit_status.return_value = rc
+            return [mock.MagicMock(), mock_stdout, mock.MagicMock()]
+        return ssh_exec_side_effect
+
+    def make_local_exec_side_effect(self, fake_ip):
+        """
+        Run the cleanup script locally, with a fake "ip" command and
+        namespace directory in a temporary directory.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        netns_dir = os.path.join(tmp_dir, 'netns')
+        os.mkdir(netns_dir)
+        open(os.path.join(netns_dir, 'qrouter-routerid1'), 'w').close()
+        ip_path = os.path.join(tmp_dir, 'ip')
+        with open(ip_path, 'w') as ip_file:
+            ip_file.write(fake_ip)
+        os.chmod(ip_path, 0o755)
+        patcher = mock.patch.object(ha_tool.RemoteRouterNsCleanup,
+                                    'NETNS_RUN_DIR', netns_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env = dict(os.environ, NETNS_DIR=netns_dir,
+                   PATH=tmp_dir + os.pathsep + os.environ['PATH'])
+
+        def local_exec_side_effect(command, **kwargs):
+            process = subprocess.Popen(['sh', '-c', command], env=env,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       universal_newlines=True)
+            out = process.communicate()[0]
+            mock_stdout = mock.MagicMock()
+            mock_stdout.readlines.return_value = out.splitlines(True)
+            mock_stdout.channel.recv_exit_status.return_value = \
+                process.returncode
+            return [mock.MagicMock(), mock_stdout, mock.MagicMock()]
+        return netns_dir, local_exec_side_effect
+
+    @mock.patch('neutron-ha-tool.paramiko.SSHClient')
+    def test_namespace_vanishing_during_cleanup_is_no_error(self, mock_ssh):
+        # the namespace disappears when its pids are queried
+        netns_dir, side_effect = self.make_local_exec_side_effect(
+            '#!/bin/sh\n'
+            'case "$2" in\n'
+            'pids) rm -f "$NETNS_DIR/$3";\n'
+            '      echo "Cannot open network namespace: No such file"\n'
+            '      exit 1;;\n'
+            'delete) echo "Cannot remove namespace file"; exit 1;;\n'
+            'esac\n'
+        )
+        mock_ssh.return_value.exec_command.side_effect = side_effect
         ns_cleanup = ha_tool.RemoteRouterNsCleanup("host1", "routerid1")
+
         ns_cleanup.delete_router_namespace()
-        expected_calls = [
-            mock.call("ip netns list", get_pty=mock.ANY, timeout=mock.ANY),
-            mock.call("ip netns pids qrouter-routerid1", get_pty=mock.ANY,
-                      timeout=mock.ANY),
-            mock.call("kill 1234", get_pty=mock.ANY, timeout=mock.ANY),
-            mock.call("kill 1235", get_pty=mock.ANY, timeout=mock.ANY),
-            mock.call("ip netns pids qrouter-routerid1", get_pty=mock.ANY,
-                      timeout=mock.ANY),
-            mock.call("ip netns delete qrouter-routerid1", get_pty=mock.ANY,
-                      timeout=mock.ANY)
-        ]
+
+        self.assertEqual([], os.listdir(netns_dir))
+
+    @mock.patch('neutron-ha-tool.paramiko.SSHClient')
+    def test_namespace_without_processes_deleted_without_waiting(self,
+                                                                 mock_ssh):
+        netns_dir, side_effect = self.make_local_exec_side_effect(
+            '#!/bin/sh\n'
+            'case "$2" in\n'
+            'pids) exit 0;;\n'
+            'delete) rm "$NETNS_DIR/$3";;\n'
+            'esac\n'
+        )
+        mock_ssh.return_value.exec_command.side_effect = side_effect
+        ns_cleanup = ha_tool.RemoteRouterNsCleanup("host1", "routerid1")
+
+        started_at = time.time()
+        ns_cleanup.delete_router_namespace()
+
+        self.assertLess(time.time() - started_at, 1)
+        self.assertEqual([], os.listdir(netns_dir))
+
+    @mock.patch('neutron-ha-tool.paramiko.SSHClient')
+    def test_namespace_deleted(self, mock_ssh):
+        mock_ssh.return_value.exec_command.side_effect = \
+            self.make_ssh_exec_side_effect(0, [])
+        ns_cleanup = ha_tool.RemoteRouterNsCleanup("host1", "routerid1")
+        ns_cleanup.delete_router_namespace()
+
         mock_ssh.return_value.connect.assert_called_once_with(
             "host1", timeout=mock.ANY)
-        mock_ssh.return_value.exec_command.assert_has_calls(expected_calls)
+        mock_ssh.return_value.exec_command.assert_called_once_with(
+            mock.ANY, get_pty=mock.ANY, timeout=mock.ANY)
+        command = mock_ssh.return_value.exec_command.call_args[0][0]
+        self.assertTrue(command.startswith('ns=qrouter-routerid1;'))
+        self.assertIn('ip netns pids "$ns"', command)
+        self.assertIn('kill -s $sig $pids', command)
+        self.assertTrue(command.endswith('ip netns delete "$ns"'))
 
     @mock.patch('neutron-ha-tool.paramiko.SSHClient')
     def test_namespace_does_not_exist(self, mock_ssh):
-        def side_effect_namespace_absent(*args, **kwargs):
-            mock_stdout = mock.MagicMock()
-            mock_stdout.readlines.return_value = []
-            mock_stdout.channel.recv_exit_status.return_value = 0
-            if args[0].startswith('ip netns list'):
-                mock_stdout.readlines.return_value = ["qrouter-otherid\r\n"]
-            return [mock.MagicMock(), mock_stdout, mock.MagicMock()]
-
+        # the fake "ip" records every call and fails
+        netns_dir, side_effect = self.make_local_exec_side_effect(
+            '#!/bin/sh\n'
+            'echo "$@" >> "$NETNS_DIR/../ip-calls"\n'
+            'exit 1\n'
+        )
+        os.remove(os.path.join(netns_dir, 'qrouter-routerid1'))
+        mock_ssh.return_value.exec_command.side_effect = side_effect
         ns_cleanup = ha_tool.RemoteRouterNsCleanup("host1", "routerid1")
-        mock_ssh.return_value.exec_command.side_effect = \
-            side_effect_namespace_absent
+
         ns_cleanup.delete_router_namespace()
+
         mock_ssh.return_value.exec_command.assert_called_once_with(
-            "ip netns list", timeout=mock.ANY, get_pty=mock.ANY)
+            mock.ANY, timeout=mock.ANY, get_pty=mock.ANY)
+        self.assertFalse(
+            os.path.exists(os.path.join(netns_dir, '..', 'ip-calls')))
+
+    @mock.patch('neutron-ha-tool.paramiko.SSHClient')
+    def test_namespace_delete_failure_raises_runtime_error(self, mock_ssh):
+        mock_ssh.return_value.exec_command.side_effect = \
+            self.make_ssh_exec_side_effect(
+                1, ["Cannot remove namespace file: Device busy\r\n"])
+        ns_cleanup = ha_tool.RemoteRouterNsCleanup("host1", "routerid1")
+
+        with self.assertRaises(RuntimeError) as ctx:
+            ns_cleanup.delete_router_namespace()
+
+        self.assertEqual(
+            'Failed to delete namespace qrouter-routerid1 on host host1: '
+            'Cannot remove namespace file: Device busy', str(ctx.exception))
 
     @mock.patch('neutron-ha-tool.paramiko.SSHClient')
     def test_ssh_command_timeout(self, mock_ssh):
@@ -472,6 +920,8 @@ class TestArgumentParsing(unittest.TestCase):
                 ssh_delete_namespace=False,
                 agent_selection_mode='least-busy',
                 router_list_file=None,
+                migration_workers=1,
+                router_count_cache=True,
                 target_agent_id=None,
                 target_host=None,
                 wait_for_router=True
@@ -479,6 +929,15 @@ class TestArgumentParsing(unittest.TestCase):
             params
         )
 
+    def test_argparser_built_only_once(self):
+        with mock.patch.object(ha_tool, '_argparser', None):
+            with mock.patch.object(ha_tool, 'build_argparser') as build:
+                first = ha_tool.make_argparser()
+                second = ha_tool.make_argparser()
+
+        build.assert_called_once_with()
+        self.assertIs(first, second)
+
     def test_target_agent_id_and_target_host_are_mutually_exclusive(self):
         argparser = ha_tool.make_argparser()
 
@@ -486,6 +945,20 @@ class TestArgumentParsing(unittest.TestCase):
             argparser.parse_args(
                 ['--target-host', 'host', '--target-agent-id', 'agent-id'])
 
+    def test_migration_workers_must_be_positive(self):
+        argparser = ha_tool.make_argparser()
+
+        for workers in ['0', '-1', 'many']:
+            with self.assertRaises(SystemExit):
+                argparser.parse_args(['--migration-workers', workers])
+
+    def test_setting_migration_workers_option(self):
+        argparser = ha_tool.make_argparser()
+
+        params = argparser.parse_args(['--migration-workers', '4'])
+
+        self.assertEqual(4, params.migration_workers)
+
     def test_setting_target_agent_id_option(self):
         argparser = ha_tool.make_argparser()
 